@@ -4,6 +4,7 @@ from opentherm import SignalExit, SignalAlarm
 import logging
 import signal
 import json
+from time import perf_counter
 import paho.mqtt.client as mqtt
 
 # Values used to parse boolean values of incoming messages
@@ -31,6 +32,12 @@ settings = {
         "sub_topic_namespace": "otgw/set",
         "retain": False,
         "changed_messages_only": False
+    },
+    # Local output sinks besides MQTT, e.g. [{"type": "stdout"}]
+    "sinks": [],
+    "trace" : {
+        "enabled": False,
+        "buckets": 32
     }
 }
 
@@ -68,6 +75,10 @@ with open(args.config) as f:
         settings['otgw'].update(overrides['otgw'])
     if 'mqtt' in overrides and isinstance(overrides['mqtt'], dict):
         settings['mqtt'].update(overrides['mqtt'])
+    if 'sinks' in overrides and isinstance(overrides['sinks'], list):
+        settings['sinks'] = overrides['sinks']
+    if 'trace' in overrides and isinstance(overrides['trace'], dict):
+        settings['trace'].update(overrides['trace'])
 
 # Set the namespace of the mqtt messages from the settings
 opentherm.pub_topic_namespace=settings['mqtt']['pub_topic_namespace']
@@ -79,6 +90,21 @@ logging.basicConfig(level=num_level, format=log_format)
 log = logging.getLogger(__name__)
 log.info('Loglevel is %s', logging.getLevelName(log.getEffectiveLevel()))
 
+# Set up per-frame latency tracing
+if settings['trace']['enabled']:
+    from opentherm_trace import OTGWTracer
+    if settings['trace']['buckets'] < 2:
+        raise ValueError('Invalid number of trace buckets: %s' % settings['trace']['buckets'])
+    tracer = OTGWTracer(buckets=settings['trace']['buckets'])
+    log.info('Latency tracing enabled, send SIGUSR1 to dump the histograms')
+
+    def sig_dump_handler(signal, frame):
+        log.info("Latency histograms: %s", json.dumps(tracer.dump()))
+
+    signal.signal(signal.SIGUSR1, sig_dump_handler)
+else:
+    tracer = None
+
 # Store messages (and publish only changed values on mqtt)
 if settings['mqtt']['changed_messages_only']:
     stored_messages = {}
@@ -101,6 +127,16 @@ def on_mqtt_message(client, userdata, msg):
         msg.topic, 
         str(msg.payload.decode('ascii', 'ignore'))))
     namespace = settings['mqtt']['sub_topic_namespace']
+    # Publish the latency histograms on request, optionally resetting them
+    if tracer and msg.topic == "{}/diagnostics/latency".format(namespace):
+        mqtt_client.publish(
+            topic="{}/diagnostics/latency".format(opentherm.pub_topic_namespace),
+            payload=json.dumps(tracer.dump()),
+            qos=settings['mqtt']['qos'],
+            retain=False)
+        if msg.payload.decode('ascii', 'ignore') == 'reset':
+            tracer.reset()
+        return
     command_generators={
         "{}/room_setpoint/temporary".format(namespace): \
             lambda _ :"TT={:.2f}".format(float(_) if is_float(_) else 0),
@@ -138,6 +174,9 @@ def on_otgw_message(message):
     if type(message) is not tuple:
         log.error("interal malformed message received - message was probably incorrectly parsed")
         return
+    # Pass every message on to the local sinks, bypassing the broker
+    for sink in sinks:
+        sink(message)
     # Force retain for device state
     if message[0] == opentherm.pub_topic_namespace and (message[1] == 'online' or message[1] == 'offline'):
         retain=True
@@ -155,11 +194,18 @@ def on_otgw_message(message):
         # Update stored messages dict
         stored_messages[message[0]] = message[1]
     # Send out messages to the MQTT broker
-    mqtt_client.publish(
+    if tracer:
+        publish_stamp = perf_counter()
+    info = mqtt_client.publish(
         topic=message[0],
         payload=message[1],
         qos=settings['mqtt']['qos'],
         retain=retain)
+    if tracer:
+        tracer.published(info.mid, publish_stamp)
+
+def on_mqtt_publish(client, userdata, mid):
+    tracer.acked(mid)
 
 def is_float(value):
     try:
@@ -184,6 +230,8 @@ if args.verbose:
     mqtt_client.enable_logger()
 mqtt_client.on_connect = on_mqtt_connect
 mqtt_client.on_message = on_mqtt_message
+if tracer:
+    mqtt_client.on_publish = on_mqtt_publish
 
 if settings['mqtt']['username']:
     mqtt_client.username_pw_set(
@@ -207,6 +255,23 @@ mqtt_client.connect_async(
     bind_address=settings['mqtt']['bind_address'])
 mqtt_client.loop_start()
 
+log.info("Initializing local sinks")
+
+# Import the sinks module only when sinks are configured and return a
+# reference to the type of each sink
+sink_types = {
+    "stdout": lambda: __import__('opentherm_sinks',
+                             globals(), locals(), ['OTGWStdoutSink'], 0) \
+                             .OTGWStdoutSink,
+    "unix":   lambda: __import__('opentherm_sinks',
+                             globals(), locals(), ['OTGWUnixSocketSink'], 0) \
+                             .OTGWUnixSocketSink,
+    "shm":    lambda: __import__('opentherm_sinks',
+                             globals(), locals(), ['OTGWSharedMemorySink'], 0) \
+                             .OTGWSharedMemorySink,
+}
+sinks = [sink_types[sink['type']]()(**sink) for sink in settings['sinks']]
+
 log.info("Initializing OTGW")
 
 # Import the module for the correct gateway type and return a reference to
@@ -222,9 +287,13 @@ otgw_type = {
 }[settings['otgw']['type']]()
 
 # Create the actual instance of the client
-otgw_client = otgw_type(on_otgw_message, **settings['otgw'])
+otgw_client = otgw_type(on_otgw_message, tracer=tracer, **settings['otgw'])
 
 # Start the gateway client's worker thread
 otgw_client.start()
 # Block until the gateway client is stopped
 otgw_client.join()
+
+# The worker thread has stopped, so no more messages reach the sinks
+for sink in sinks:
+    sink.close()
@@ -1,6 +1,6 @@
 import re
-from threading import Thread
-from time import sleep
+from threading import Event, Thread
+from time import sleep, perf_counter
 import logging
 import collections
 
@@ -156,7 +156,13 @@ class OTGWClient(object):
         self._worker_running = False
         self._listener = listener
         self._worker_thread = None
+        # Set when the worker thread has finished. Used instead of the
+        # thread's own state, which is unreliable once a join() has been
+        # interrupted by an exception raised from a signal handler
+        self._worker_stopped = Event()
         self._send_buffer = collections.deque()
+        # Optional OTGWTracer for per-frame latency tracing
+        self._tracer = kwargs.get('tracer')
 
     def open(self):
         r"""
@@ -204,14 +210,20 @@ class OTGWClient(object):
     def join(self):
         r"""
         Block until the worker thread finishes or exit signal received
+
+        Reconnects when no data is received in time, and keeps blocking
+        afterwards, so the worker thread has stopped when this returns.
         """
-        try:
-            while self._worker_thread.is_alive():
-                self._worker_thread.join(1)
-        except SignalExit:
-            self.stop()
-        except SignalAlarm:
-            self.reconnect()
+        while True:
+            try:
+                while not self._worker_stopped.wait(1):
+                    pass
+                return
+            except SignalExit:
+                self.stop()
+                return
+            except SignalAlarm:
+                self.reconnect()
 
     def start(self):
         r"""
@@ -219,6 +231,7 @@ class OTGWClient(object):
         """
         if self._worker_thread:
             raise RuntimeError("Already running")
+        self._worker_stopped.clear()
         self._worker_thread = Thread(target=self._worker)
         self._worker_thread.start()
         log.info("Started worker thread #%s", self._worker_thread.ident)
@@ -231,7 +244,7 @@ class OTGWClient(object):
             raise RuntimeError("Not running")
         log.info("Stopping worker thread #%s", self._worker_thread.ident)
         self._worker_running = False
-        self._worker_thread.join()
+        self._worker_stopped.wait()
 
     def reconnect(self, reconnect_pause=10):
         r"""
@@ -275,6 +288,12 @@ class OTGWClient(object):
         # Create a buffer for read data
         data = ""
 
+        tracer = self._tracer
+        # The stamp of the read that returned the first bytes of the partial
+        # line in the buffer, and of the last read that returned data
+        read_stamp = None
+        last_read_stamp = None
+
         while self._worker_running:
             log.debug("Worker run with initial data: '%s'", data)
             try:
@@ -283,8 +302,14 @@ class OTGWClient(object):
                     self.write(self._send_buffer[0])
                     self._send_buffer.popleft()
                 # Receive TCP serial data for MQTT
+                if tracer:
+                    read_start = perf_counter()
                 read = self.read(timeout=0.5)
                 if read:
+                    if tracer:
+                        last_read_stamp = tracer.record('read', read_start)
+                        if not data:
+                            read_stamp = last_read_stamp
                     data += read
             except ConnectionException:
                 self.reconnect()
@@ -304,7 +329,15 @@ class OTGWClient(object):
                 # most lines will yield no messages or just one, but
                 # flags-based lines may return more than one.
                 log.debug("Raw message: %s", raw_message)
-                for msg in get_messages(raw_message):
+                if tracer:
+                    split_stamp = perf_counter()
+                messages = get_messages(raw_message)
+                if tracer:
+                    # Decode eagerly so the decoder can be timed
+                    messages = list(messages)
+                    tracer.line(read_stamp or split_stamp, split_stamp,
+                                perf_counter())
+                for msg in messages:
                     try:
                         # Pass each message on to the listener
                         log.debug("Execute message: '%s'", msg)
@@ -313,14 +346,23 @@ class OTGWClient(object):
                         # Log a warning when an exception occurs in the
                         # listener
                         log.exception("Error in listener handling for message '%s', jump to close and reconnect: %s", raw_message, str(e))
+                    if tracer:
+                        tracer.listened()
+                if tracer:
+                    tracer.done()
 
                 # Strip the consumed line from the buffer
                 data = data[m.end():]
+                if tracer:
+                    # Any data left was returned by the last read, as the
+                    # consumed line ended in it
+                    read_stamp = last_read_stamp if data else None
                 log.debug("Left data: '%s'", data)
 
         # After the read loop, close the connection and clean up
         self.close()
         self._worker_thread = None
+        self._worker_stopped.set()
 
 class ConnectionException(Exception):
     pass
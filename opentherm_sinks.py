@@ -0,0 +1,323 @@
+import errno
+import json
+import logging
+import mmap
+import os
+import socket
+import stat
+import struct
+import sys
+from threading import Lock, Thread
+from time import time
+
+log = logging.getLogger(__name__)
+
+
+def ndjson_line(message):
+    r"""
+    Serialize a decoded message to a single NDJSON line
+
+    Returns the line as bytes, terminated with a line feed
+    """
+    return (json.dumps({"topic": message[0], "value": message[1], "ts": time()},
+                       separators=(',', ':')) + "\n").encode('utf-8')
+
+
+class OTGWSink(object):
+    r"""
+    An abstract output sink for decoded OTGW messages.
+
+    A sink is a listener, just like the one passed to an OTGWClient: it is
+    called with every decoded (topic, value) tuple. Implementing classes only
+    need to override `write`, and `close` if they hold any resources.
+    """
+    def __init__(self, **kwargs):
+        self._closed = False
+
+    def __call__(self, message):
+        if self._closed:
+            return
+        try:
+            self.write(message)
+        except Exception as e:
+            # A failing local consumer should never take down the bridge
+            log.warning("Failed to write message to %s: %s",
+                        type(self).__name__, str(e))
+
+    def write(self, message):
+        r"""
+        Write a decoded message to the sink
+
+        Must be overridden in implementing classes. Called from the OTGW
+        worker thread, so it should not block.
+        """
+        raise NotImplementedError("Abstract method")
+
+    def close(self):
+        r"""
+        Release the resources held by the sink
+
+        Implementing classes should call this first, so no more messages are
+        written to the sink.
+        """
+        self._closed = True
+
+
+class OTGWStdoutSink(OTGWSink):
+    r"""
+    A sink writing one JSON object per line to stdout
+
+    The writes block, so the consumer reading stdout must keep up; a slow
+    consumer stalls the OTGW worker thread. When the consumer goes away, the
+    sink disables itself.
+    """
+
+    def __init__(self, **kwargs):
+        super(OTGWStdoutSink, self).__init__(**kwargs)
+        self._stream = getattr(sys.stdout, 'buffer', sys.stdout)
+
+    def write(self, message):
+        r"""
+        Write the message as an NDJSON line and flush it immediately
+        """
+        if self._stream is None:
+            return
+        try:
+            self._stream.write(ndjson_line(message))
+            self._stream.flush()
+        except OSError as e:
+            if not isinstance(e, BrokenPipeError) and e.errno != errno.EPIPE:
+                raise
+            log.warning("Stdout consumer went away, disabling the stdout sink")
+            self._stream = None
+
+
+class OTGWUnixSocketSink(OTGWSink):
+    r"""
+    A sink fanning out NDJSON lines to all clients of a Unix domain socket
+
+    Clients that can not keep up (their socket buffer is full) are
+    disconnected rather than stalling the worker thread.
+    """
+
+    def __init__(self, **kwargs):
+        super(OTGWUnixSocketSink, self).__init__(**kwargs)
+        self._path = kwargs.get('path', '/run/otgw.sock')
+        self._clients = []
+        self._lock = Lock()
+
+        try:
+            mode = os.stat(self._path).st_mode
+        except FileNotFoundError:
+            pass
+        else:
+            # Only remove a stale socket, never any other file
+            if not stat.S_ISSOCK(mode):
+                raise ValueError('Not a unix socket: %s' % self._path)
+            os.unlink(self._path)
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.bind(self._path)
+        os.chmod(self._path, int(str(kwargs.get('mode', '660')), 8))
+        self._socket.listen(int(kwargs.get('backlog', 8)))
+        log.info('Listening on unix socket %s', self._path)
+
+        self._accept_thread = Thread(target=self._acceptor)
+        self._accept_thread.daemon = True
+        self._accept_thread.start()
+
+    def _acceptor(self):
+        while True:
+            try:
+                client, _ = self._socket.accept()
+            except OSError:
+                # The listening socket was closed
+                break
+            client.setblocking(False)
+            with self._lock:
+                self._clients.append(client)
+            log.debug('Unix socket client connected (%d total)', len(self._clients))
+
+    def write(self, message):
+        r"""
+        Send the message as an NDJSON line to every connected client
+        """
+        if not self._clients:
+            return
+        line = ndjson_line(message)
+        with self._lock:
+            for client in list(self._clients):
+                try:
+                    if client.send(line) == len(line):
+                        continue
+                except OSError:
+                    pass
+                # Either the client went away or it is too slow and we've
+                # only been able to send part of the line; drop it to keep
+                # the stream intact
+                log.debug('Dropping unix socket client')
+                self._clients.remove(client)
+                client.close()
+
+    def close(self):
+        r"""
+        Stop accepting clients, disconnect all clients and remove the socket
+        """
+        super(OTGWUnixSocketSink, self).close()
+        self._socket.close()
+        with self._lock:
+            for client in self._clients:
+                client.close()
+            self._clients = []
+        try:
+            os.unlink(self._path)
+        except OSError:
+            pass
+
+
+# Layout of the shared memory table. All integers are little-endian.
+#
+# Header:  magic (8s), version (I), slots (I), slot size (I), used slots (I)
+# Slot:    sequence (Q), timestamp (d), topic length (H), value length (H),
+#          topic (utf-8), value (json)
+#
+# Every topic gets its own slot, assigned in order of first appearance, so
+# the table always holds the latest value of every topic. There is a single
+# writer. Each slot is guarded by its own sequence number (a seqlock): it is
+# odd while the slot is being written, and readers retry when the sequence
+# is odd or changed while they were reading the slot.
+#
+# Python has no memory barriers, so the order of the stores is only
+# guaranteed to be seen by readers on strongly ordered CPUs (x86). On weakly
+# ordered CPUs such as ARM, a reader may see a new sequence number with a
+# torn payload, so readers must also validate the payload and retry when it
+# is invalid, as `read_shared_memory` does.
+shm_magic = b'OTGWVALS'
+shm_version = 1
+shm_header = struct.Struct('<8sIIII')
+shm_slot_header = struct.Struct('<QdHH')
+
+
+class OTGWSharedMemorySink(OTGWSink):
+    r"""
+    A sink keeping the latest value of every topic in shared memory
+
+    The table is a memory mapped file (by default in /dev/shm), so any local
+    process can map it and read the values without a lock. See
+    `read_shared_memory` for a reader.
+    """
+
+    def __init__(self, **kwargs):
+        super(OTGWSharedMemorySink, self).__init__(**kwargs)
+        self._path = kwargs.get('path', '/dev/shm/otgw')
+        self._slots = int(kwargs.get('slots', 256))
+        self._slot_size = int(kwargs.get('slot_size', 128))
+        self._payload_size = self._slot_size - shm_slot_header.size
+        if self._payload_size <= 0:
+            raise ValueError('Invalid shared memory slot size: %d' % self._slot_size)
+        # topic -> slot index
+        self._indexes = {}
+        # The current sequence number of each used slot
+        self._sequences = []
+
+        size = shm_header.size + self._slots * self._slot_size
+        fd = os.open(self._path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, size)
+            self._mmap = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        shm_header.pack_into(self._mmap, 0, shm_magic, shm_version,
+                             self._slots, self._slot_size, 0)
+        log.info('Writing latest values to shared memory %s (%d slots)',
+                 self._path, self._slots)
+
+    def write(self, message):
+        r"""
+        Store the message in the slot of its topic
+        """
+        topic = message[0].encode('utf-8')
+        value = json.dumps(message[1]).encode('utf-8')
+        if len(topic) + len(value) > self._payload_size:
+            log.debug("Message '%s' does not fit in a shared memory slot", message[0])
+            return
+
+        index = self._indexes.get(message[0])
+        if index is None:
+            if len(self._sequences) >= self._slots:
+                log.warning("No free shared memory slot for topic '%s'", message[0])
+                # Don't warn again for this topic
+                self._indexes[message[0]] = -1
+                return
+            index = len(self._sequences)
+            self._indexes[message[0]] = index
+            self._sequences.append(0)
+        elif index < 0:
+            return
+
+        offset = shm_header.size + index * self._slot_size
+        # Each write bumps the slot sequence twice: odd while writing, even
+        # when done
+        sequence = self._sequences[index]
+        shm_slot_header.pack_into(self._mmap, offset, sequence + 1,
+                                  time(), len(topic), len(value))
+        start = offset + shm_slot_header.size
+        self._mmap[start:start + len(topic) + len(value)] = topic + value
+        struct.pack_into('<Q', self._mmap, offset, sequence + 2)
+        self._sequences[index] = sequence + 2
+
+        if sequence == 0:
+            # Publish the new slot to the readers only once it is complete
+            struct.pack_into('<I', self._mmap, shm_header.size - 4,
+                             len(self._sequences))
+
+    def close(self):
+        r"""
+        Unmap and remove the shared memory file
+        """
+        super(OTGWSharedMemorySink, self).close()
+        self._mmap.close()
+        try:
+            os.unlink(self._path)
+        except OSError:
+            pass
+
+
+def read_shared_memory(path='/dev/shm/otgw', retries=10):
+    r"""
+    Read the latest value of every topic from a shared memory table
+
+    Returns a dict mapping the topics to (timestamp, value) tuples
+    """
+    with open(path, 'rb') as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        magic, version, slots, slot_size, used = shm_header.unpack_from(buf, 0)
+        if magic != shm_magic or version != shm_version:
+            raise ValueError('Not an OTGW shared memory table: %s' % path)
+
+        values = {}
+        for index in range(min(used, slots)):
+            offset = shm_header.size + index * slot_size
+            for _ in range(retries):
+                before, ts, topic_len, value_len = \
+                    shm_slot_header.unpack_from(buf, offset)
+                start = offset + shm_slot_header.size
+                payload = buf[start:start + topic_len + value_len]
+                after = struct.unpack_from('<Q', buf, offset)[0]
+                if before != after or not before or before & 1 \
+                        or topic_len + value_len > slot_size - shm_slot_header.size:
+                    continue
+                try:
+                    topic = payload[:topic_len].decode('utf-8')
+                    value = json.loads(payload[topic_len:].decode('utf-8'))
+                except ValueError:
+                    # A torn read, which a weakly ordered CPU may let
+                    # through the sequence check
+                    continue
+                values[topic] = (ts, value)
+                break
+            # Otherwise the slot is being written continuously; skip it
+            # this time
+        return values
+    finally:
+        buf.close()
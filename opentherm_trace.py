@@ -0,0 +1,197 @@
+import logging
+from threading import Lock
+from time import perf_counter
+
+log = logging.getLogger(__name__)
+
+# The stages a line passes through, from the wire to the MQTT broker:
+#   read:     duration of a `read` call that returned data
+#   buffer:   read of the first bytes of a line returned -> line split off
+#             the buffer
+#   decode:   line split -> messages decoded
+#   listener: messages decoded -> listener returned (filtering, publish call)
+#   ack:      publish called -> paho's on_publish for the mid
+#   total:    read of the first bytes returned -> paho's on_publish for the mid
+stages = ('read', 'buffer', 'decode', 'listener', 'ack', 'total')
+
+
+class LatencyHistogram(object):
+    r"""
+    A fixed-size histogram of latencies
+
+    Latencies are counted in power-of-two buckets of microseconds, so
+    recording a sample is cheap and never allocates. The last bucket is
+    open-ended and holds all latencies too large for the others.
+    """
+    def __init__(self, buckets=32):
+        self._buckets = [0] * buckets
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, seconds):
+        r"""
+        Record a single latency, in seconds
+        """
+        us = int(seconds * 1000000)
+        if us < 0:
+            us = 0
+        self._buckets[min(us.bit_length(), len(self._buckets) - 1)] += 1
+        self.count += 1
+        self.total += us
+        if us > self.max:
+            self.max = us
+
+    def percentile(self, p):
+        r"""
+        Return the upper bound in microseconds of the bucket holding the
+        p-th percentile
+        """
+        if not self.count:
+            return 0
+        rank = self.count * p / 100.0
+        seen = 0
+        for bucket, n in enumerate(self._buckets):
+            seen += n
+            if n and seen >= rank:
+                if bucket == len(self._buckets) - 1:
+                    break
+                return min((1 << bucket) - 1, self.max)
+        return self.max
+
+    def _label(self, bucket):
+        # Bucket n holds the latencies with a bit length of n
+        if bucket == len(self._buckets) - 1:
+            return ">={}us".format(1 << (bucket - 1))
+        return "<{}us".format(1 << bucket)
+
+    def dump(self):
+        r"""
+        Return the histogram as a JSON-serializable dict
+        """
+        return {
+            "count": self.count,
+            "mean_us": self.total // self.count if self.count else 0,
+            "p50_us": self.percentile(50),
+            "p99_us": self.percentile(99),
+            "max_us": self.max,
+            "buckets": {self._label(bucket): n
+                        for bucket, n in enumerate(self._buckets) if n},
+        }
+
+
+class OTGWTracer(object):
+    r"""
+    Per-frame latency tracing from byte arrival to MQTT publish acknowledge
+
+    The OTGW worker thread stamps each line as it passes through the read,
+    split and decode stages; the MQTT side registers the mid of every publish
+    and completes the trace in paho's `on_publish` callback.
+    """
+    def __init__(self, buckets=32, max_pending=1024):
+        self._buckets = buckets
+        self._max_pending = max_pending
+        self._lock = Lock()
+        # The stamps of the line currently handled by the listener. Only
+        # set by the worker thread; other threads read it into a local once
+        self._line = None
+        self.reset()
+
+    def reset(self):
+        r"""
+        Clear all histograms and pending publishes
+        """
+        with self._lock:
+            self.histograms = {stage: LatencyHistogram(self._buckets)
+                               for stage in stages}
+            # mid -> (read stamp, publish stamp)
+            self._pending = {}
+            # mid -> ack stamp, for acks arriving before publish returned
+            self._early_acks = {}
+
+    def record(self, stage, start, end=None):
+        r"""
+        Record the latency of a stage, returning the end stamp
+        """
+        if end is None:
+            end = perf_counter()
+        self.histograms[stage].record(end - start)
+        return end
+
+    def line(self, read, split, decoded):
+        r"""
+        Set the stamps of the line that is about to be passed to the listener
+        """
+        self.record('buffer', read, split)
+        self.record('decode', split, decoded)
+        self._line = (read, decoded)
+
+    def listened(self):
+        r"""
+        Called when the listener returned for a message of the current line
+        """
+        line = self._line
+        if line:
+            self.record('listener', line[1])
+
+    def done(self):
+        r"""
+        Called when all messages of the current line have been handled, so
+        publishes outside of the worker loop are not traced
+        """
+        self._line = None
+        if self._early_acks:
+            # Early acks of this line's publishes have been matched by now;
+            # any left are of untraced publishes (e.g. the online message)
+            # and would be mistaken for an ack once paho's mids wrap
+            with self._lock:
+                self._early_acks.clear()
+
+    def published(self, mid, start):
+        r"""
+        Register an MQTT publish of the current line by its mid, with the
+        stamp taken right before the publish was called
+        """
+        line = self._line
+        if not line:
+            return
+        with self._lock:
+            ack = self._early_acks.pop(mid, None)
+            if ack is None or ack < start:
+                # No ack yet, or a stale one of an earlier publish with the
+                # same mid
+                self._pending[mid] = (line[0], start)
+                self._evict(self._pending)
+                return
+            # The ack and total stages are recorded from both the worker
+            # and paho's thread, so only under the lock
+            self.record('ack', start, ack)
+            self.record('total', line[0], ack)
+
+    def acked(self, mid):
+        r"""
+        Complete the trace of a publish; to be called from paho's on_publish
+        """
+        now = perf_counter()
+        with self._lock:
+            stamps = self._pending.pop(mid, None)
+            if stamps is None:
+                # With QoS 0 paho may call on_publish before publish()
+                # returned the mid to us
+                self._early_acks[mid] = now
+                self._evict(self._early_acks)
+                return
+            self.record('ack', stamps[1], now)
+            self.record('total', stamps[0], now)
+
+    def _evict(self, pending):
+        # Never acknowledged publishes (e.g. while disconnected) should not
+        # grow without bounds; drop the oldest ones
+        while len(pending) > self._max_pending:
+            del pending[next(iter(pending))]
+
+    def dump(self):
+        r"""
+        Return all histograms as a JSON-serializable dict
+        """
+        return {stage: self.histograms[stage].dump() for stage in stages}